@@ -1,16 +1,24 @@
-import chardet
+import asyncio
+import hashlib
 import os
-from fastapi import FastAPI, Depends, HTTPException
+import queue
+import re
+from threading import Lock
+from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
+from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy import Column, Index, Integer, String, create_engine, func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
 from dotenv import load_dotenv
 from bs4 import BeautifulSoup
-import requests
+import httpx
 from typing import List
 from pydantic import BaseModel
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 log_formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
 log_file = 'app.log'
@@ -19,14 +27,26 @@ handler = RotatingFileHandler(log_file, maxBytes=10000000, backupCount=5, encodi
 handler.setFormatter(log_formatter)
 handler.setLevel(logging.INFO)
 
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, handler, respect_handler_level=True)
+
 app_logger = logging.getLogger()
 app_logger.setLevel(logging.INFO)
-app_logger.addHandler(handler)
+app_logger.addHandler(QueueHandler(log_queue))
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL, connect_args={"options": "-c timezone=utc"})
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"options": "-c timezone=utc"},
+    insertmanyvalues_page_size=1000,
+    executemany_mode="values_plus_batch",
+    pool_size=20,
+    max_overflow=40,
+    pool_pre_ping=True,
+    pool_recycle=1800
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -40,16 +60,27 @@ class Vacancy(Base):
     employment_format = Column(String)
     salary = Column(Integer, nullable=True)
 
+    __table_args__ = (
+        Index('vacancies_title_desc_uq', func.md5(title), func.md5(description), unique=True),
+    )
+
 class Applicant(Base):
     __tablename__ = 'applicants'
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
     skills = Column(String)
 
+    __table_args__ = (
+        Index('applicants_name_skills_uq', func.md5(name), func.md5(skills), unique=True),
+    )
+
 def create_tables():
     try:
         print("Creating tables...")
         Base.metadata.create_all(bind=engine)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
         print("Tables created successfully!")
     except Exception as e:
         print(f"Error creating tables: {e}")
@@ -66,9 +97,6 @@ class VacancyCreate(VacancyBase):
 class VacancyResponse(VacancyBase):
     id: int
 
-    class Config:
-        from_attributes = True
-
 class ApplicantBase(BaseModel):
     name: str
     skills: str
@@ -79,13 +107,39 @@ class ApplicantCreate(ApplicantBase):
 class ApplicantResponse(ApplicantBase):
     id: int
 
-    class Config:
-        from_attributes = True
+SALARY_RE = re.compile(r'\d[\d \xa0\u202f]*')
+SALARY_SPACES = str.maketrans('', '', ' \xa0\u202f')
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    timeout=30.0,
+    follow_redirects=True,
+    headers={"User-Agent": USER_AGENT}
+)
 
 app = FastAPI()
 
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
+@app.on_event("startup")
+def start_log_listener():
+    log_listener.start()
+
+@app.on_event("startup")
+def startup_create_tables():
+    create_tables()
+
+@app.on_event("shutdown")
+async def close_client():
+    await client.aclose()
+
+@app.on_event("shutdown")
+def stop_log_listener():
+    log_listener.stop()
+
 def get_db():
     db = SessionLocal()
     try:
@@ -93,126 +147,164 @@ def get_db():
     finally:
         db.close()
 
-@app.get("/vacancies", response_model=List[VacancyResponse])
-def get_vacancies(query: str, db: Session = Depends(get_db)):
-    url = f'https://hh.ru/search/vacancy?text={query}'
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
-    app_logger.info(f"Fetching data from: {url}")
-    response = requests.get(url, headers=headers)
+def md5_hex(value: str):
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+def insert_rows(db: Session, model, rows, key):
+    if not rows:
+        return []
+    key_columns = [getattr(model, name) for name in key]
+    with db.begin():
+        stmt = pg_insert(model).on_conflict_do_nothing(
+            index_elements=[func.md5(column) for column in key_columns]
+        ).returning(model.id, *key_columns)
+        ids = {tuple(row[1:]): row[0] for row in db.execute(stmt, rows)}
+
+        missing = {tuple(row[name] for name in key) for row in rows} - ids.keys()
+        if missing:
+            existing = db.execute(
+                select(model.id, *key_columns).where(
+                    tuple_(*(func.md5(column) for column in key_columns)).in_(
+                        [tuple(md5_hex(value) for value in values) for values in missing]
+                    )
+                )
+            )
+            ids.update({tuple(row[1:]): row[0] for row in existing})
+    invalidate_count(model)
+    return [ids[tuple(row[name] for name in key)] for row in rows]
+
+serp_cache = TTLCache(maxsize=256, ttl=60)
+
+count_cache = TTLCache(maxsize=2, ttl=10)
+count_cache_lock = Lock()
+
+@cached(count_cache, key=lambda db, model: hashkey(model.__tablename__), lock=count_cache_lock)
+def count_rows(db: Session, model):
+    return db.query(model).count()
+
+def invalidate_count(model):
+    with count_cache_lock:
+        count_cache.pop(hashkey(model.__tablename__), None)
+
+async def fetch_page(url: str, params: dict):
+    app_logger.info("Fetching data from: %s %s", url, params)
+    response = await client.get(url, params=params)
     if response.status_code != 200:
-        app_logger.error(f"Error fetching data from hh.ru: {response.status_code}")
+        app_logger.error("Error fetching data from hh.ru: %s", response.status_code)
         raise HTTPException(status_code=response.status_code, detail="Error fetching data from hh.ru")
-    encoding = 'utf-8'
-    decoded_content = response.content.decode(encoding)
 
-    app_logger.info(f"Response status code: {response.status_code}")
-    app_logger.info(f"Response content length: {len(response.text)}")
-    app_logger.info(f"Response content preview: {response.content[:500]}")
+    app_logger.info("Response status code: %s", response.status_code)
+    app_logger.info("Response content length: %s", len(response.content))
+    app_logger.debug("Response content preview: %r", response.content[:200])
 
-    encoding = chardet.detect(response.content)['encoding']
-    app_logger.info(f"Detected encoding: {encoding}")
+    return response.text
 
-    decoded_content = response.content.decode(encoding)
+async def fetch_pages(url: str, query: str, pages: int):
+    results = await asyncio.gather(
+        *(fetch_page(url, {"text": query, "page": page}) for page in range(pages)),
+        return_exceptions=True
+    )
 
-    with open('page_content.html', 'w', encoding='utf-8') as file:
-        file.write(decoded_content)
+    contents = []
+    for page, result in enumerate(results):
+        if isinstance(result, Exception):
+            app_logger.error("Failed to fetch %s page %s: %r", url, page, result)
+        else:
+            contents.append(result)
+    if not contents:
+        raise results[0]
+    return contents, len(contents) < pages
 
-    soup = BeautifulSoup(decoded_content, 'html.parser')
-    app_logger.info(f"Soup object created: {soup.prettify()[:500]}")
+@app.get("/vacancies", response_model=List[VacancyResponse])
+async def get_vacancies(query: str, pages: int = Query(1, ge=1, le=20), refresh: bool = False, db: Session = Depends(get_db)):
+    cache_key = ("vacancies", query, pages)
+    if not refresh and cache_key in serp_cache:
+        app_logger.info("Serving cached vacancies for query: %s", query)
+        return serp_cache[cache_key]
 
     vacancies = []
-    for vacancy in soup.select('.vacancy-serp-item'):
-        title = vacancy.select_one('.vacancy-serp-item__title').text if vacancy.select_one('.vacancy-serp-item__title') else None
-        description = vacancy.select_one('.vacancy-serp-item__snippet').text if vacancy.select_one('.vacancy-serp-item__snippet') else None
-        skills = [skill.text for skill in vacancy.select('.bloko-tag__section_text')] if vacancy.select('.bloko-tag__section_text') else []
-        employment_format = vacancy.select_one('.vacancy-serp-item__meta-info').text if vacancy.select_one('.vacancy-serp-item__meta-info') else None
-        salary_element = vacancy.select_one('.vacancy-serp-item__sidebar')
-
-        salary = None
-        if salary_element:
-            salary_text = salary_element.text.replace('руб.', '').replace(' ', '')
-            try:
-                salary = int(salary_text)
-            except ValueError:
-                salary = None
-
-        app_logger.info(f"Parsed vacancy: title={title}, description={description}, skills={skills}, employment_format={employment_format}, salary={salary}")
-
-        if title and description:
-            vac = Vacancy(
-                title=title,
-                description=description,
-                skills=', '.join(skills),
-                employment_format=employment_format,
-                salary=salary
-            )
-            db.add(vac)
-            db.commit()
-            db.refresh(vac)
-            vacancies.append(vac)
-        else:
-            app_logger.warning(f"Skipping vacancy with missing title or description: title={title}, description={description}")
-    
-    app_logger.info(f"Total vacancies fetched: {len(vacancies)}")
-    return vacancies
+    contents, partial = await fetch_pages('https://hh.ru/search/vacancy', query, pages)
+    for decoded_content in contents:
+        if app_logger.isEnabledFor(logging.DEBUG):
+            with open('page_content.html', 'w', encoding='utf-8') as file:
+                file.write(decoded_content)
+
+        soup = BeautifulSoup(decoded_content, 'lxml')
+
+        for vacancy in soup.select('.vacancy-serp-item'):
+            title_element = vacancy.select_one('.vacancy-serp-item__title')
+            title = title_element.get_text() if title_element else None
+            description_element = vacancy.select_one('.vacancy-serp-item__snippet')
+            description = description_element.get_text() if description_element else None
+            skills = [skill.get_text() for skill in vacancy.select('.bloko-tag__section_text')]
+            employment_format_element = vacancy.select_one('.vacancy-serp-item__meta-info')
+            employment_format = employment_format_element.get_text() if employment_format_element else None
+            salary_element = vacancy.select_one('.vacancy-serp-item__sidebar')
+            salary_match = SALARY_RE.search(salary_element.get_text()) if salary_element else None
+            salary = int(salary_match.group().translate(SALARY_SPACES)) if salary_match else None
+
+            app_logger.debug("Parsed vacancy: title=%s, description=%s, skills=%s, employment_format=%s, salary=%s", title, description, skills, employment_format, salary)
+
+            if title and description:
+                vacancies.append({
+                    "title": title,
+                    "description": description,
+                    "skills": ', '.join(skills),
+                    "employment_format": employment_format,
+                    "salary": salary
+                })
+            else:
+                app_logger.warning("Skipping vacancy with missing title or description: title=%s, description=%s", title, description)
+
+    ids = await run_in_threadpool(insert_rows, db, Vacancy, vacancies, ('title', 'description'))
+    app_logger.info("Total vacancies fetched: %s", len(vacancies))
+    response = [VacancyResponse(id=vac_id, **vac) for vac_id, vac in zip(ids, vacancies)]
+    if not partial:
+        serp_cache[cache_key] = response
+    return response
 
 @app.get("/applicants", response_model=List[ApplicantResponse])
-def get_applicants(query: str, db: Session = Depends(get_db)):
-    url = f'https://hh.ru/search/resume?text={query}'
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
-    app_logger.info(f"Fetching data from: {url}")
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        app_logger.error(f"Error fetching data from hh.ru: {response.status_code}")
-        raise HTTPException(status_code=response.status_code, detail="Error fetching data from hh.ru")
-    encoding = 'utf-8'
-    decoded_content = response.content.decode(encoding)
-    
-    app_logger.info(f"Response status code: {response.status_code}")
-    app_logger.info(f"Response content length: {len(response.text)}")
-    app_logger.info(f"Response content preview: {response.content[:500]}")
-
-    encoding = chardet.detect(response.content)['encoding']
-    app_logger.info(f"Detected encoding: {encoding}")
-
-    decoded_content = response.content.decode(encoding)
-    soup = BeautifulSoup(decoded_content, 'html.parser')
-    app_logger.info(f"Soup object created: {soup.prettify()[:500]}")
+async def get_applicants(query: str, pages: int = Query(1, ge=1, le=20), refresh: bool = False, db: Session = Depends(get_db)):
+    cache_key = ("applicants", query, pages)
+    if not refresh and cache_key in serp_cache:
+        app_logger.info("Serving cached applicants for query: %s", query)
+        return serp_cache[cache_key]
 
     applicants = []
-    for applicant in soup.select('.resume-serp-item'):
-        name = applicant.select_one('.resume-search-item__fullname').text if applicant.select_one('.resume-search-item__fullname') else None
-        skills = [skill.text for skill in applicant.select('.bloko-tag__section_text')] if applicant.select('.bloko-tag__section_text') else []
-
-        app_logger.info(f"Parsed applicant: name={name}, skills={skills}")
-
-        if name:
-            appl = Applicant(
-                name=name,
-                skills=', '.join(skills)
-            )
-            db.add(appl)
-            db.commit()
-            db.refresh(appl)
-            applicants.append(appl)
-        else:
-            app_logger.warning(f"Skipping applicant with missing name: name={name}")
-    
-    app_logger.info(f"Total applicants fetched: {len(applicants)}")
-    return applicants
+    contents, partial = await fetch_pages('https://hh.ru/search/resume', query, pages)
+    for decoded_content in contents:
+        soup = BeautifulSoup(decoded_content, 'lxml')
+
+        for applicant in soup.select('.resume-serp-item'):
+            name_element = applicant.select_one('.resume-search-item__fullname')
+            name = name_element.get_text() if name_element else None
+            skills = [skill.get_text() for skill in applicant.select('.bloko-tag__section_text')]
+
+            app_logger.debug("Parsed applicant: name=%s, skills=%s", name, skills)
+
+            if name:
+                applicants.append({
+                    "name": name,
+                    "skills": ', '.join(skills)
+                })
+            else:
+                app_logger.warning("Skipping applicant with missing name: name=%s", name)
+
+    ids = await run_in_threadpool(insert_rows, db, Applicant, applicants, ('name', 'skills'))
+    app_logger.info("Total applicants fetched: %s", len(applicants))
+    response = [ApplicantResponse(id=appl_id, **appl) for appl_id, appl in zip(ids, applicants)]
+    if not partial:
+        serp_cache[cache_key] = response
+    return response
 
 @app.get("/analytics/vacancies")
 def get_vacancies_analytics(db: Session = Depends(get_db)):
-    num_vacancies = db.query(Vacancy).count()
+    num_vacancies = count_rows(db, Vacancy)
     return {"num_vacancies": num_vacancies}
 
 @app.get("/analytics/applicants")
 def get_applicants_analytics(db: Session = Depends(get_db)):
-    num_applicants = db.query(Applicant).count()
+    num_applicants = count_rows(db, Applicant)
     return {"num_applicants": num_applicants}
 
 if __name__ == "__main__":
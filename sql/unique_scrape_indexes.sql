@@ -0,0 +1,22 @@
+-- Unique indexes used by the ON CONFLICT DO NOTHING inserts in app/main.py.
+-- create_tables() creates them on startup; run this by hand on a database that
+-- already holds duplicate rows, since the index build fails until they are removed.
+
+BEGIN;
+
+DELETE FROM vacancies a
+USING vacancies b
+WHERE a.id > b.id
+  AND md5(a.title) = md5(b.title)
+  AND md5(a.description) = md5(b.description);
+
+DELETE FROM applicants a
+USING applicants b
+WHERE a.id > b.id
+  AND md5(a.name) = md5(b.name)
+  AND md5(a.skills) = md5(b.skills);
+
+CREATE UNIQUE INDEX IF NOT EXISTS vacancies_title_desc_uq ON vacancies (md5(title), md5(description));
+CREATE UNIQUE INDEX IF NOT EXISTS applicants_name_skills_uq ON applicants (md5(name), md5(skills));
+
+COMMIT;